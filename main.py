@@ -1,31 +1,134 @@
+import logging
 import os
-from typing import List, Optional
-from fastapi import FastAPI, HTTPException
+import time
+from operator import itemgetter
+from typing import Annotated, List, Optional
+import msgspec
+from fastapi import BackgroundTasks, Depends, FastAPI, HTTPException, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
-from datetime import datetime
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import ORJSONResponse
+from pymongo import InsertOne, UpdateOne
+from pymongo.write_concern import WriteConcern
+from datetime import datetime, timezone
 
-from database import db, create_document, get_documents
-from schemas import Transaction, Budget, ChatMessage
+from database import db, create_document, get_documents, aggregate_documents
+from schemas import Transaction, Budget
 
-app = FastAPI(title="Personal Finance Assistant API")
+logger = logging.getLogger(__name__)
+
+app = FastAPI(title="Personal Finance Assistant API", default_response_class=ORJSONResponse)
+
+# Comma-separated list of allowed frontend origins, e.g. "https://app.example.com"
+CORS_ORIGINS = [o.strip() for o in os.getenv("CORS_ORIGINS", "*").split(",") if o.strip()]
 
 app.add_middleware(
     CORSMiddleware,
-    allow_origins=["*"],
-    allow_credentials=True,
-    allow_methods=["*"],
+    allow_origins=CORS_ORIGINS,
+    allow_methods=["GET", "POST"],
     allow_headers=["*"],
+    max_age=86400,
 )
+# Transaction lists and summaries repeat the same keys and compress well
+app.add_middleware(GZipMiddleware, minimum_size=1024)
+
+
+# YYYY-MM with a real month number; empty means all time
+MONTH_PATTERN = r"^(\d{4}-(0[1-9]|1[0-2]))?$"
+
+# Upper bound on documents a single list request may pull
+MAX_LIST_LIMIT = 1000
+
+# Summaries keyed by month (None = all time); entries expire after the TTL
+# and are dropped early whenever a write touches that month. At most
+# SUMMARY_CACHE_MAXSIZE entries are kept. Each write also bumps the month's
+# version so a summary computed before the write is not cached after it.
+SUMMARY_CACHE_TTL = 30
+SUMMARY_CACHE_MAXSIZE = 64
+_summary_cache = {}
+_summary_versions = {}
+
+
+def invalidate_summary(month: Optional[str]):
+    for key in (month, None):
+        _summary_versions[key] = _summary_versions.get(key, 0) + 1
+        _summary_cache.pop(key, None)
+
+
+def cache_summary(month: Optional[str], result: dict):
+    now = time.monotonic()
+    _summary_cache.pop(month, None)
+    if len(_summary_cache) >= SUMMARY_CACHE_MAXSIZE:
+        for key in [k for k, (expires, _) in _summary_cache.items() if expires <= now]:
+            del _summary_cache[key]
+    while len(_summary_cache) >= SUMMARY_CACHE_MAXSIZE:
+        # Oldest insertion first
+        del _summary_cache[next(iter(_summary_cache))]
+    _summary_cache[month] = (now + SUMMARY_CACHE_TTL, result)
+
+
+@app.on_event("startup")
+async def ensure_indexes():
+    """Create the indexes the summary/budget queries rely on."""
+    if db is None:
+        return
+    try:
+        # Serves the per-month rollup rebuild's equality match on year_month
+        await db.transaction.create_index([("year_month", 1), ("type", 1), ("category", 1)])
+        await db.budget.create_index([("month", 1), ("category", 1)])
+        await db.summary_monthly.create_index([("month", 1), ("category", 1), ("type", 1)], unique=True)
+        # Backfill year_month on transactions stored before it was recorded
+        await db.transaction.update_many(
+            {"year_month": {"$exists": False}, "date": {"$type": "date"}},
+            [{"$set": {"year_month": {"$dateToString": {"format": "%Y-%m", "date": "$date"}}}}],
+        )
+        if await db.summary_monthly.estimated_document_count() == 0:
+            await rebuild_summary_monthly()
+    except Exception:
+        logger.exception("Failed to prepare indexes and summary rollups")
+
+
+async def rebuild_summary_monthly(month: Optional[str] = None):
+    """Recompute the per-month rollups from the raw transactions.
+
+    Pass month (YYYY-MM) to rebuild only that month. Run it by hand with
+    `python main.py rebuild-summary [YYYY-MM]` if the rollups have drifted.
+    """
+    await aggregate_documents("transaction", [
+        {"$match": {"year_month": month if month else {"$exists": True}}},
+        {"$group": {
+            "_id": {
+                "month": "$year_month",
+                "category": "$category",
+                "type": "$type",
+            },
+            "sum_amount": {"$sum": "$amount"},
+            "count": {"$sum": 1},
+        }},
+        {"$project": {
+            "_id": 0,
+            "month": "$_id.month",
+            "category": "$_id.category",
+            "type": "$_id.type",
+            "sum_amount": 1,
+            "count": 1,
+        }},
+        {"$merge": {
+            "into": "summary_monthly",
+            "on": ["month", "category", "type"],
+            "whenMatched": "replace",
+            "whenNotMatched": "insert",
+        }},
+    ]).to_list(length=None)
 
 
 @app.get("/")
-def read_root():
+async def read_root():
     return {"message": "Personal Finance Assistant API is running"}
 
 
 @app.get("/test")
-def test_database():
+async def test_database():
     response = {
         "backend": "✅ Running",
         "database": "❌ Not Available",
@@ -40,7 +143,7 @@ def test_database():
             response["database_url"] = "✅ Set" if os.getenv("DATABASE_URL") else "❌ Not Set"
             response["database_name"] = "✅ Set" if os.getenv("DATABASE_NAME") else "❌ Not Set"
             try:
-                collections = db.list_collection_names()
+                collections = await db.list_collection_names()
                 response["collections"] = collections[:10]
                 response["database"] = "✅ Connected & Working"
                 response["connection_status"] = "Connected"
@@ -53,99 +156,164 @@ def test_database():
     return response
 
 
-# ---------- Finance Endpoints ----------
+def msgspec_body(model):
+    """Dependency that decodes the raw JSON body straight into a msgspec Struct."""
+    decoder = msgspec.json.Decoder(model)
+
+    async def decode(request: Request):
+        try:
+            return decoder.decode(await request.body())
+        except msgspec.MsgspecError as e:
+            # Same shape as FastAPI's own validation errors
+            raise HTTPException(
+                status_code=422,
+                detail=[{"loc": ["body"], "msg": str(e), "type": "value_error"}],
+            )
 
-class TransactionCreate(Transaction):
-    pass
+    return decode
 
 
+# ---------- Finance Endpoints ----------
+
 @app.post("/api/transactions")
-def add_transaction(txn: TransactionCreate):
+async def add_transaction(txn: Transaction = Depends(msgspec_body(Transaction))):
     try:
-        txn_dict = txn.model_dump()
-        # Convert date string to datetime for storage
+        txn_dict = msgspec.structs.asdict(txn)
+        # BSON has no date-only type, store midnight of that day
+        d = txn.date
+        txn_dict["date"] = datetime(d.year, d.month, d.day)
+        month = f"{d.year:04d}-{d.month:02d}"
+        # Feeds the summary_monthly rollup rebuilds
+        txn_dict["year_month"] = month
+        inserted_id = await create_document("transaction", txn_dict)
+        # Keep the monthly rollup in step so summaries never rescan history.
+        # The transaction is already stored, so a failed update must not turn
+        # into an error (a client retry would insert it twice); recompute the
+        # month from the transactions instead.
         try:
-            txn_dict["date"] = datetime.strptime(txn_dict["date"], "%Y-%m-%d")
+            await db.summary_monthly.bulk_write([
+                UpdateOne(
+                    {"month": month, "category": txn.category, "type": txn.type},
+                    {"$inc": {"sum_amount": txn.amount, "count": 1}},
+                    upsert=True,
+                )
+            ])
         except Exception:
-            pass
-        inserted_id = create_document("transaction", txn_dict)
+            logger.exception("Rollup update failed for %s, rebuilding the month", month)
+            try:
+                await rebuild_summary_monthly(month)
+            except Exception:
+                logger.exception("Rollup rebuild failed for %s", month)
+        invalidate_summary(month)
         return {"id": inserted_id, "status": "ok"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
 @app.get("/api/transactions")
-def list_transactions(limit: Optional[int] = 100):
+async def list_transactions(limit: int = Query(100, ge=1, le=MAX_LIST_LIMIT)):
     try:
-        docs = get_documents("transaction", {}, limit)
-        for d in docs:
-            if isinstance(d.get("date"), datetime):
-                d["date"] = d["date"].date().isoformat()
-            if "_id" in d:
-                d["id"] = str(d.pop("_id"))
+        # Format id/date in mongod so the documents can be returned untouched
+        pipeline = [
+            {"$limit": limit},
+            {"$addFields": {
+                "id": {"$toString": "$_id"},
+                "date": {"$cond": [
+                    {"$eq": [{"$type": "$date"}, "date"]},
+                    {"$dateToString": {"format": "%Y-%m-%d", "date": "$date"}},
+                    "$date",
+                ]},
+            }},
+            {"$project": {"_id": 0, "year_month": 0}},
+        ]
+        docs = await aggregate_documents("transaction", pipeline).to_list(length=None)
         return {"items": docs}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
 @app.get("/api/summary")
-def summary(month: Optional[str] = None):
+async def summary(month: Optional[str] = Query(None, pattern=MONTH_PATTERN)):
     """Return simple income/expense totals and category breakdown.
     month format: YYYY-MM (filters by that month).
     """
+    month = month or None
+    cached = _summary_cache.get(month)
+    if cached and cached[0] > time.monotonic():
+        return cached[1]
+    version = _summary_versions.get(month, 0)
     try:
-        flt = {}
+        # Totals and budgets come back from one aggregation: the budget rows
+        # are appended with $unionWith and told apart by their "limit" field
+        budget_stage = {"$unionWith": {
+            "coll": "budget",
+            "pipeline": [
+                {"$match": {"month": month} if month else {}},
+                {"$project": {"_id": 0, "category": 1, "limit": 1}},
+            ],
+        }}
         if month:
-            # filter date range for month
-            year, m = map(int, month.split("-"))
-            start = datetime(year, m, 1)
-            if m == 12:
-                end = datetime(year + 1, 1, 1)
-            else:
-                end = datetime(year, m + 1, 1)
-            flt["date"] = {"$gte": start, "$lt": end}
-        docs = get_documents("transaction", flt, None)
-        income = sum(d.get("amount", 0) for d in docs if d.get("type") == "income")
-        expense = sum(d.get("amount", 0) for d in docs if d.get("type") == "expense")
+            # Read the precomputed monthly rollup
+            rows = aggregate_documents("summary_monthly", [
+                {"$match": {"month": month}},
+                {"$project": {"_id": 0, "type": 1, "category": 1, "sum_amount": 1}},
+                budget_stage,
+            ])
+        else:
+            # Let MongoDB total amounts per (type, category) so only the grouped
+            # rows come back instead of every transaction
+            rows = aggregate_documents("transaction", [
+                {"$group": {
+                    "_id": {"type": "$type", "category": "$category"},
+                    "sum_amount": {"$sum": "$amount"},
+                }},
+                {"$project": {"_id": 0, "type": "$_id.type", "category": "$_id.category", "sum_amount": 1}},
+                budget_stage,
+            ])
+        income = 0
+        expense = 0
         by_cat = {}
-        for d in docs:
-            if d.get("type") == "expense":
-                cat = d.get("category", "Other")
-                by_cat[cat] = by_cat.get(cat, 0) + d.get("amount", 0)
-        # Budgets for that month
-        budget_docs = get_documents("budget", {"month": month} if month else {}, None)
         budgets = {}
-        for b in budget_docs:
-            budgets[b["category"]] = b["limit"]
-        return {
+        async for r in rows:
+            if "limit" in r:
+                budgets[r["category"]] = r["limit"]
+                continue
+            kind = r.get("type")
+            if kind == "income":
+                income += r["sum_amount"]
+            elif kind == "expense":
+                expense += r["sum_amount"]
+                cat = r.get("category") or "Other"
+                by_cat[cat] = by_cat.get(cat, 0) + r["sum_amount"]
+        result = {
             "income": income,
             "expense": expense,
             "net": income - expense,
             "categories": by_cat,
             "budgets": budgets,
         }
+        if _summary_versions.get(month, 0) == version:
+            cache_summary(month, result)
+        return result
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
-class BudgetCreate(Budget):
-    pass
-
-
 @app.post("/api/budgets")
-def set_budget(b: BudgetCreate):
+async def set_budget(b: Budget = Depends(msgspec_body(Budget))):
     try:
-        inserted_id = create_document("budget", b)
+        inserted_id = await create_document("budget", msgspec.structs.asdict(b))
+        invalidate_summary(b.month)
         return {"id": inserted_id, "status": "ok"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
 @app.get("/api/budgets")
-def list_budgets(month: Optional[str] = None):
+async def list_budgets(month: Optional[str] = None, limit: int = Query(MAX_LIST_LIMIT, ge=1, le=MAX_LIST_LIMIT)):
     try:
         flt = {"month": month} if month else {}
-        docs = get_documents("budget", flt, None)
+        docs = await get_documents("budget", flt, limit)
         for d in docs:
             if "_id" in d:
                 d["id"] = str(d.pop("_id"))
@@ -158,51 +326,75 @@ def list_budgets(month: Optional[str] = None):
 # Note: If an external LLM is needed, integrate here later. For now,
 # we provide a helpful assistant that summarizes finance data using our DB.
 
-class ChatRequest(BaseModel):
+class ChatRequest(msgspec.Struct):
     message: str
-    month: Optional[str] = None
+    # \Z rather than $: msgspec matches with re.search, where $ also accepts a trailing newline
+    month: Optional[Annotated[str, msgspec.Meta(pattern=r"^(\d{4}-(0[1-9]|1[0-2]))?\Z")]] = None
+
+
+# Set CHAT_LOG_FIRE_AND_FORGET=1 to write chat logs unacknowledged (w=0).
+CHAT_LOG_FIRE_AND_FORGET = os.getenv("CHAT_LOG_FIRE_AND_FORGET", "").lower() in ("1", "true", "yes")
+
+
+async def log_chat(user_msg: str, reply: str):
+    """Store the user/assistant pair in a single round-trip (best effort)"""
+    if db is None:
+        return
+    now = datetime.now(timezone.utc)
+    coll = db.chatmessage
+    if CHAT_LOG_FIRE_AND_FORGET:
+        coll = coll.with_options(write_concern=WriteConcern(w=0))
+    try:
+        await coll.bulk_write([
+            InsertOne({"role": "user", "content": user_msg, "session_id": None, "created_at": now, "updated_at": now}),
+            InsertOne({"role": "assistant", "content": reply, "session_id": None, "created_at": now, "updated_at": now}),
+        ], ordered=False)
+    except Exception:
+        pass
 
 
 @app.post("/api/chat")
-def chat(req: ChatRequest):
+async def chat(background_tasks: BackgroundTasks, req: ChatRequest = Depends(msgspec_body(ChatRequest))):
     try:
         user_msg = req.message.lower()
         month = req.month
         # Use summary to ground responses
-        s = summary(month)
+        s = await summary(month)
         if "spend" in user_msg or "expense" in user_msg:
-            top_cat = None
+            top_cat = top_val = None
             if s["categories"]:
-                top_cat = max(s["categories"], key=lambda k: s["categories"][k])
+                top_cat, top_val = max(s["categories"].items(), key=itemgetter(1))
             reply = (
                 f"For {month or 'all time'}, you spent ${s['expense']:.2f}. "
-                + (f"Your top spending category is {top_cat} at ${s['categories'][top_cat]:.2f}. " if top_cat else "")
+                + (f"Your top spending category is {top_cat} at ${top_val:.2f}. " if top_cat else "")
             )
         elif "income" in user_msg:
             reply = f"For {month or 'all time'}, your income totals ${s['income']:.2f}. Net is ${s['net']:.2f}."
         elif "budget" in user_msg:
-            lines = ["Budgets:"]
-            for cat, lim in s["budgets"].items():
-                spent = s["categories"].get(cat, 0)
-                lines.append(f"- {cat}: ${spent:.2f} / ${lim:.2f} ({'over' if spent>lim else 'under'})")
-            reply = "\n".join(lines) if len(lines) > 1 else "No budgets set yet."
+            cats = s["categories"]
+            lines = [
+                f"- {cat}: ${cats.get(cat, 0):.2f} / ${lim:.2f} ({'over' if cats.get(cat, 0) > lim else 'under'})"
+                for cat, lim in s["budgets"].items()
+            ]
+            reply = "\n".join(["Budgets:", *lines]) if lines else "No budgets set yet."
         else:
             reply = (
                 "I can help with your personal finance. Ask things like 'show expenses this month', "
                 "'what's my income', or 'how am I doing against my budget?'."
             )
-        # Optionally store message
-        try:
-            create_document("chatmessage", ChatMessage(role="user", content=req.message))
-            create_document("chatmessage", ChatMessage(role="assistant", content=reply))
-        except Exception:
-            pass
+        # Optionally store message, after the response has been sent
+        background_tasks.add_task(log_chat, req.message, reply)
         return {"reply": reply, "summary": s}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
 if __name__ == "__main__":
+    import sys
+    if len(sys.argv) > 1 and sys.argv[1] == "rebuild-summary":
+        import asyncio
+        asyncio.run(rebuild_summary_monthly(sys.argv[2] if len(sys.argv) > 2 else None))
+        sys.exit(0)
     import uvicorn
     port = int(os.getenv("PORT", 8000))
     uvicorn.run(app, host="0.0.0.0", port=port)
@@ -1,17 +1,23 @@
 """
 Database Schemas for Personal Finance Assistant
 
-Each Pydantic model represents a collection in your MongoDB database.
+Each model represents a collection in your MongoDB database.
 The collection name is the lowercase of the class name.
 
+Transaction and Budget are request bodies on hot endpoints, so they are
+msgspec Structs decoded straight from JSON; the rest are Pydantic models.
+
 - User -> "user"
 - Transaction -> "transaction"
 - Budget -> "budget"
 - ChatMessage -> "chatmessage"
 """
 
+import datetime
+
+import msgspec
 from pydantic import BaseModel, Field
-from typing import Optional
+from typing import Annotated, Literal, Optional
 
 
 class User(BaseModel):
@@ -20,20 +26,21 @@ class User(BaseModel):
     is_active: bool = Field(True, description="Whether user is active")
 
 
-class Transaction(BaseModel):
+class Transaction(msgspec.Struct):
     """Personal finance transaction schema"""
-    amount: float = Field(..., gt=0, description="Transaction amount (absolute value)")
-    type: str = Field(..., pattern=r"^(expense|income)$", description="Transaction type")
-    category: str = Field(..., description="Category such as groceries, rent, salary")
-    date: str = Field(..., pattern=r"^\d{4}-\d{2}-\d{2}$", description="Transaction date (YYYY-MM-DD)")
-    notes: Optional[str] = Field(None, description="Optional description or note")
+    amount: Annotated[float, msgspec.Meta(gt=0, description="Transaction amount (absolute value)")]
+    type: Annotated[Literal["expense", "income"], msgspec.Meta(description="Transaction type")]
+    category: Annotated[str, msgspec.Meta(description="Category such as groceries, rent, salary")]
+    date: Annotated[datetime.date, msgspec.Meta(description="Transaction date (YYYY-MM-DD)")]
+    notes: Annotated[Optional[str], msgspec.Meta(description="Optional description or note")] = None
 
 
-class Budget(BaseModel):
+class Budget(msgspec.Struct):
     """Monthly budget per category"""
-    month: str = Field(..., pattern=r"^\d{4}-\d{2}$", description="Budget month, e.g., 2025-01")
-    category: str = Field(..., description="Budget category")
-    limit: float = Field(..., ge=0, description="Spending limit for the category in this month")
+    # \Z rather than $: msgspec matches with re.search, where $ also accepts a trailing newline
+    month: Annotated[str, msgspec.Meta(pattern=r"^\d{4}-\d{2}\Z", description="Budget month, e.g., 2025-01")]
+    category: Annotated[str, msgspec.Meta(description="Budget category")]
+    limit: Annotated[float, msgspec.Meta(ge=0, description="Spending limit for the category in this month")]
 
 
 class ChatMessage(BaseModel):